@@ -125,12 +125,41 @@ def revoke_permissions(zfs_bin: str, dataset: str, user: str, perms: Set[str], d
                 print(f"  ! failed: {err or f'rc={rc}'}", file=sys.stderr)
 
 
-def build_desired_state(helper: object, datasets: List[str]) -> Dict[str, Dict[str, Set[str]]]:
+def load_policies(helper: object, artifact: Optional[str]) -> Dict[str, dict]:
+    """Load every user's policy from the compiled artifact, falling back to policy.d.
+
+    A missing artifact is only tolerated for the daemon's default path. As in
+    the daemon, users whose policy.d changed since compilation come from policy.d.
+    """
+    path = artifact or helper.COMPILED_POLICY_PATH
+    compiled = None
+    try:
+        compiled = helper.load_compiled_policy(path)
+    except FileNotFoundError:
+        if artifact:
+            raise RuntimeError(f"Policy artifact {artifact} not found")
+    except (OSError, ValueError) as exc:
+        raise RuntimeError(f"{path}: {exc}")
+    policy_root = Path(helper.POLICY_ROOT)
+    names = {entry.name for entry in policy_root.iterdir() if entry.is_dir()} if policy_root.is_dir() else set()
+    if compiled is None:
+        if not policy_root.is_dir():
+            raise RuntimeError(f"Policy root {policy_root} not found")
+        return {name: helper.load_policy(name) for name in sorted(names)}
+    users, sources = compiled
+    policies = {}
+    for name in sorted(names | set(users)):
+        if helper.compiled_policy_stale(sources, name):
+            print(f"warning: {path} is stale for {name}; using {policy_root / name}", file=sys.stderr)
+            policies[name] = helper.load_policy(name)
+        else:
+            policies[name] = users.get(name, {})
+    return policies
+
+
+def build_desired_state(helper: object, datasets: List[str], policies: Dict[str, dict]) -> Dict[str, Dict[str, Set[str]]]:
     datasets_set = set(datasets)
     desired: Dict[str, Dict[str, Set[str]]] = defaultdict(lambda: defaultdict(set))
-    policy_root = Path(helper.POLICY_ROOT)
-    if not policy_root.is_dir():
-        raise RuntimeError(f"Policy root {policy_root} not found")
 
     managed_actions = {
         "mount": {"mount"},
@@ -143,12 +172,7 @@ def build_desired_state(helper: object, datasets: List[str]) -> Dict[str, Dict[s
 
     property_keys_allowed = helper.PROP_KEY_ALLOW
 
-    for entry in sorted(policy_root.iterdir()):
-        if not entry.is_dir():
-            continue
-        user = entry.name
-        policy = helper.load_policy(user)
-
+    for user, policy in sorted(policies.items()):
         # dataset-bound actions
         for action, perms in managed_actions.items():
             for dataset in datasets:
@@ -158,7 +182,9 @@ def build_desired_state(helper: object, datasets: List[str]) -> Dict[str, Dict[s
         # property permissions
         setprop_entries = helper.list_allows(policy, "setprop")
         if setprop_entries:
-            value_rules = helper.parse_setprop_values(helper.list_allows(policy, "setprop.values"))
+            value_rules = policy.get("setprop.rules")
+            if value_rules is None:
+                value_rules = helper.parse_setprop_values(helper.list_allows(policy, "setprop.values"))
             if value_rules:
                 keys = {rule[0] for rule in value_rules if rule[0]}
                 prop_keys = (keys & property_keys_allowed) or property_keys_allowed
@@ -171,7 +197,7 @@ def build_desired_state(helper: object, datasets: List[str]) -> Dict[str, Dict[s
 
         # create / rename_to (parent-focused permissions)
         for action, perm in (("create", "create"), ("rename_to", "rename"), ("share", "share")):
-            for actor, pattern in helper.list_allows(policy, action):
+            for actor, pattern, *_ in helper.list_allows(policy, action):
                 if actor not in (user, "*"):
                     continue
                 targets = expand_pattern_targets(helper, pattern, datasets, datasets_set)
@@ -221,6 +247,8 @@ def parse_args() -> argparse.Namespace:
     parser = argparse.ArgumentParser(description="Apply ZFS delegation to mirror zfs-helper policies.")
     parser.add_argument("--zfs-bin", default="/usr/sbin/zfs", help="Path to zfs binary (default: /usr/sbin/zfs)")
     parser.add_argument("--dry-run", action="store_true", help="Preview changes without executing zfs allow/unallow")
+    parser.add_argument("--policy-artifact", default=None,
+                        help="Compiled policy to read instead of policy.d (default: the daemon's artifact, if present)")
     return parser.parse_args()
 
 
@@ -229,10 +257,11 @@ def main() -> None:
     helper = load_helper_module()
     try:
         datasets = list_datasets(args.zfs_bin)
+        policies = load_policies(helper, args.policy_artifact)
     except RuntimeError as exc:
         print(f"error: {exc}", file=sys.stderr)
         sys.exit(1)
-    desired = build_desired_state(helper, datasets)
+    desired = build_desired_state(helper, datasets, policies)
     apply_desired_state(helper, desired, args.zfs_bin, args.dry_run)
 
 
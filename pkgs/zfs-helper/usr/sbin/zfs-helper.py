@@ -1,31 +1,457 @@
 #!/usr/bin/env python3
-"""User-service-facing daemon that proxies a constrained set of ZFS commands."""
+"""User-service-facing daemon that proxies a constrained set of ZFS commands.
+
+The daemon is socket-activated, so module import sits on the latency path of
+the first request. Heavier modules (subprocess, json, re, fnmatch, pwd, grp,
+concurrent.futures) are imported on first use inside the functions needing
+them, and regexes compile lazily.
+"""
 
 import os
 import socket
 import struct
-# trunk-ignore(bandit/B404)
-import subprocess
-import fnmatch
-import pwd
-import grp
-import re
 import time
-import json
+import marshal
 
+# Fallback for process_age() where /proc is unavailable; misses interpreter start-up.
+START_TIME = time.monotonic()
 SOCK_PATH = "/run/zfs-helper.sock"
 ZFS_BIN = "/usr/sbin/zfs"
 POLICY_ROOT = "/etc/zfs-helper/policy.d"
+STATE_PATH = "/run/zfs-helper/state.bin"
+STATE_VERSION = 1
+COMPILED_POLICY_PATH = "/etc/zfs-helper/policy.compiled"
+COMPILED_POLICY_FORMAT = "zfs-helper-policy"
+COMPILED_POLICY_VERSION = 2
 LOG_TAG = "zfs-helper"
-DATASET_RE = re.compile(r"^[A-Za-z0-9:_\-.]+(?:/[A-Za-z0-9:_\-.]+)*$")
-SNAP_RE = re.compile(r"^[A-Za-z0-9:_\-.]+(?:/[A-Za-z0-9:_\-.]+)*@[A-Za-z0-9:_\-.]+$")
 PROP_KEY_ALLOW = {"mountpoint", "canmount", "sharenfs"}
 CANMOUNT_VALS = {"on", "off", "noauto"}
+BULK_WORKERS = 8
+# mountpoint values zfs mount/umount cannot act on
+UNMOUNTABLE_MOUNTPOINTS = {"", "legacy", "none", "-"}
+# Subcommands that change the pool before finishing in userland (mounting,
+# remounting children) and are followed by an ownership pass. The deadline is
+# checked before they start, but they are never killed once running.
+RUN_TO_COMPLETION_VERBS = {"create", "rename", "snapshot"}
+IDLE_TIMEOUT = float(os.environ.get("ZFS_HELPER_IDLE_TIMEOUT", "60"))
+LOG_TARGET = os.environ.get("ZFS_HELPER_LOG", "auto")
+JOURNAL_SOCKET = "/run/systemd/journal/socket"
+LOG_QUEUE_SIZE = 4096
+LOG_BATCH = 256
+LOG_BURST = 20
+LOG_BURST_WINDOW = 10.0
+AUDIT_LEVELS = {"ALLOW", "DENY", "ERROR"}
+LOG_PRIORITY = {"ERROR": 3, "WARN": 4, "DENY": 5, "ALLOW": 6, "INFO": 6}
+DIAG_DIR = "/run/zfs-helper"
+PROFILER = os.environ.get("ZFS_HELPER_PROFILER", "cprofile")
+PROFILE_SAMPLE_INTERVAL = 0.005
+TRACE_RING_SIZE = 2048
+CAPTURE_PATH = os.environ.get("ZFS_HELPER_CAPTURE", "")
+CAPTURE_FIELDS = ("dataset", "target", "snapshot", "src", "dst", "key", "value", "recursive", "force", "props")
 
-def log(level, msg, **kw):
-    """Emit a structured log line with optional key/value metadata."""
+class _LazyRegex:
+    """Regex that is compiled the first time it is used."""
+
+    def __init__(self, pattern):
+        self.pattern = pattern
+        self._compiled = None
+
+    def fullmatch(self, string):
+        if self._compiled is None:
+            import re
+            self._compiled = re.compile(self.pattern)
+        return self._compiled.fullmatch(string)
+
+DATASET_RE = _LazyRegex(r"^[A-Za-z0-9:_\-.]+(?:/[A-Za-z0-9:_\-.]+)*$")
+SNAP_RE = _LazyRegex(r"^[A-Za-z0-9:_\-.]+(?:/[A-Za-z0-9:_\-.]+)*@[A-Za-z0-9:_\-.]+$")
+
+def _format_line(level, msg, kw):
     kv = " ".join(f"{k}={v}" for k, v in kw.items())
-    print(f"{LOG_TAG} [{level}] {msg}" + (f" {kv}" if kv else ""), flush=True)
+    return f"{LOG_TAG} [{level}] {msg}" + (f" {kv}" if kv else "")
+
+def _journal_field(key):
+    name = "".join(c if c.isascii() and c.isalnum() else "_" for c in key.upper())
+    return name.lstrip("_0123456789") or "FIELD"
+
+def _journal_datagram(level, msg, kw):
+    """Encode a record in journald's native protocol; non-string values are str()'d."""
+    fields = [
+        ("MESSAGE", _format_line(level, msg, kw)),
+        ("PRIORITY", str(LOG_PRIORITY.get(level, 6))),
+        ("SYSLOG_IDENTIFIER", LOG_TAG),
+        ("LEVEL", str(level)),
+        ("EVENT", str(msg)),
+    ]
+    fields += [(_journal_field(k), str(v)) for k, v in kw.items()]
+    buf = bytearray()
+    for name, value in fields:
+        data = value.encode("utf-8", errors="replace")
+        if b"\n" in data:
+            buf += name.encode() + b"\n" + struct.pack("<Q", len(data)) + data + b"\n"
+        else:
+            buf += name.encode() + b"=" + data + b"\n"
+    return bytes(buf)
+
+class _LogWriter:
+    """Deliver log records from a background thread, off the request path.
+
+    Audit records (ALLOW/DENY/ERROR) are lossless: when the queue is full the
+    caller blocks. Other records are limited to LOG_BURST per message per
+    LOG_BURST_WINDOW and dropped when the queue is full; suppressed and
+    dropped records are reported as summary counts.
+    """
+
+    def __init__(self, target):
+        import atexit
+        import queue
+        import threading
+        self.target = target
+        self.sock = None
+        self.out = None
+        if target == "auto":
+            use_journal = "JOURNAL_STREAM" in os.environ and os.path.exists(JOURNAL_SOCKET)
+            self.target = "journal" if use_journal else "stdout"
+        if self.target == "journal":
+            self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        elif self.target.startswith("ndjson:"):
+            path = self.target[len("ndjson:"):]
+            try:
+                self.out = open(path, "a", encoding="utf-8")
+            except OSError as e:
+                print(f"{LOG_TAG} [WARN] cannot open audit log, using stdout path={path} err={e.__class__.__name__}:{e}",
+                      flush=True)
+                self.target = "stdout"
+        self.queue = queue.Queue(LOG_QUEUE_SIZE)
+        self.full = queue.Full
+        self.lock = threading.Lock()
+        self.window_start = time.monotonic()
+        self.window_counts = {}
+        self.dropped = 0
+        self.thread = threading.Thread(target=self._run, name="zfs-helper-log", daemon=True)
+        self.thread.start()
+        atexit.register(self.close)
+
+    def submit(self, level, msg, kw):
+        # msg may come from a client (the request action), so it need not be a str.
+        msg = str(msg)
+        record = (time.time(), level, msg, kw)
+        if level in AUDIT_LEVELS:
+            self.queue.put(record)
+            return
+        with self.lock:
+            self._roll_window()
+            count = self.window_counts.get(msg, 0) + 1
+            self.window_counts[msg] = count
+            if count > LOG_BURST:
+                return
+            self._offer(record)
+
+    def _offer(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except self.full:
+            self.dropped += 1
+
+    def _roll_window(self):
+        """Summarize and start a new rate-limit window once the current one ends; caller holds lock."""
+        now = time.monotonic()
+        if now - self.window_start >= LOG_BURST_WINDOW:
+            self._summarize()
+            self.window_start = now
+
+    def _summarize(self):
+        """Queue counts for records suppressed in the current window; caller holds lock."""
+        for msg, count in self.window_counts.items():
+            if count > LOG_BURST:
+                self._offer((time.time(), "WARN", "suppressed repeated log records",
+                             {"event": msg, "count": count - LOG_BURST}))
+        self.window_counts = {}
+        if self.dropped:
+            dropped, self.dropped = self.dropped, 0
+            self._offer((time.time(), "WARN", "log queue full, records dropped", {"count": dropped}))
+
+    def close(self):
+        """Flush pending records and stop the writer thread."""
+        if not self.thread.is_alive():
+            return
+        with self.lock:
+            self._summarize()
+        self.queue.put(None)
+        self.thread.join(timeout=5)
+
+    def _run(self):
+        import queue
+        while True:
+            # Wake at the end of the window so suppression counts are reported
+            # on time even when no further record arrives.
+            wait = self.window_start + LOG_BURST_WINDOW - time.monotonic()
+            try:
+                batch = [self.queue.get(timeout=max(wait, 0.01))]
+            except queue.Empty:
+                batch = []
+            with self.lock:
+                self._roll_window()
+            if not batch:
+                continue
+            while len(batch) < LOG_BATCH:
+                try:
+                    batch.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            done = None in batch
+            self._write([r for r in batch if r is not None])
+            if done:
+                return
+
+    def _write(self, batch):
+        """Deliver a batch; a record that fails is reported without losing the rest."""
+        import sys
+        for record in batch:
+            try:
+                self._emit(*record)
+            except Exception as e:
+                print(f"{LOG_TAG} [ERROR] log writer failed event={record[2]} err={e.__class__.__name__}:{e}",
+                      flush=True)
+        try:
+            (self.out or sys.stdout).flush()
+        except Exception as e:
+            print(f"{LOG_TAG} [ERROR] log writer failed: {e.__class__.__name__}:{e}", flush=True)
+
+    def _emit(self, ts, level, msg, kw):
+        if self.sock is not None:
+            try:
+                self.sock.sendto(_journal_datagram(level, msg, kw), JOURNAL_SOCKET)
+            except OSError:
+                print(_format_line(level, msg, kw))
+        elif self.out is not None:
+            import json
+            rec = {"ts": round(ts, 6), "level": level, "msg": msg}
+            rec.update(kw)
+            self.out.write(json.dumps(rec, separators=(",", ":"), default=str) + "\n")
+        else:
+            print(_format_line(level, msg, kw))
+
+_log_writer = None
+
+def log(level, msg, **kw):
+    """Queue a structured log record with optional key/value metadata."""
+    global _log_writer
+    if _log_writer is None:
+        _log_writer = _LogWriter(LOG_TARGET)
+    _log_writer.submit(level, msg, kw)
+
+# Finished request traces while tracing is on (SIGUSR2), else None.
+_trace_ring = None
+# Trace record of the request currently being handled, if traced or captured.
+_trace_req = None
+# Open request capture file when ZFS_HELPER_CAPTURE is set, else None.
+_capture_file = None
+# Active profiler while profiling is on (SIGUSR1), else None.
+_profiler = None
+
+class _NoSpan:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+_NO_SPAN = _NoSpan()
+
+class _Span:
+    __slots__ = ("req", "name", "start")
+
+    def __init__(self, req, name):
+        self.req = req
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.monotonic()
+        return self
+
+    def __exit__(self, *exc):
+        end = time.monotonic()
+        t0 = self.req["t0"]
+        self.req["spans"].append((self.name, round((self.start - t0) * 1000, 3), round((end - self.start) * 1000, 3)))
+        return False
+
+def span(name):
+    """Time a phase of the current request when tracing is on; a no-op otherwise."""
+    req = _trace_req
+    if req is None or "spans" not in req:
+        return _NO_SPAN
+    return _Span(req, name)
+
+def trace_note(**kw):
+    """Attach fields to the current request's trace record, if any."""
+    if _trace_req is not None:
+        _trace_req.update(kw)
+
+def _capture_request(req):
+    """Keep only the fields handlers read; deadlines and unknown keys are dropped."""
+    out = {"action": str(req.get("action", ""))[:64]}
+    for field in CAPTURE_FIELDS:
+        if field in req:
+            out[field] = req[field]
+    return out
+
+def open_capture(path=CAPTURE_PATH):
+    """Start appending one NDJSON envelope per request to path."""
+    global _capture_file
+    try:
+        fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o600)
+        _capture_file = os.fdopen(fd, "a", buffering=1)
+    except OSError as e:
+        log("WARN", "request capture disabled", path=path, err=f"{e.__class__.__name__}:{e}")
+        return
+    log("INFO", "capturing requests", path=path)
+
+def _write_capture(rec):
+    import json
+    envelope = {
+        "ts": rec["ts"],
+        "uid": rec.get("peer_uid"),
+        "user": rec.get("peer_user"),
+        "unit": rec.get("unit"),
+        "req": rec.get("request"),
+        "status": rec.get("status"),
+        "ms": rec["total_ms"],
+    }
+    try:
+        _capture_file.write(json.dumps(envelope, separators=(",", ":"), default=str) + "\n")
+    except OSError as e:
+        log("WARN", "request capture write failed", err=f"{e.__class__.__name__}:{e}")
+
+def _diag_path(kind, ext):
+    return os.path.join(DIAG_DIR, f"{kind}-{os.getpid()}-{int(time.time())}.{ext}")
+
+def _open_private(path):
+    return os.fdopen(os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600), "w")
+
+class _SamplingProfiler:
+    """Periodically sample every thread's stack and count collapsed stacks."""
+
+    def __init__(self, interval):
+        import threading
+        self.interval = interval
+        self.counts = {}
+        self.stop = threading.Event()
+        self.thread = threading.Thread(target=self._run, name="zfs-helper-sampler", daemon=True)
+
+    def enable(self):
+        self.thread.start()
+
+    def disable(self):
+        self.stop.set()
+        self.thread.join()
+
+    def _run(self):
+        import sys
+        skip = {self.thread.ident}
+        if _log_writer is not None:
+            skip.add(_log_writer.thread.ident)
+        while not self.stop.wait(self.interval):
+            for ident, frame in sys._current_frames().items():
+                if ident in skip:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+                    frame = frame.f_back
+                key = ";".join(reversed(stack))
+                self.counts[key] = self.counts.get(key, 0) + 1
+
+    def dump_stats(self, path):
+        """Write stacks in the collapsed format read by flamegraph tools."""
+        with _open_private(path) as f:
+            for stack, count in sorted(self.counts.items()):
+                f.write(f"{stack} {count}\n")
+
+def toggle_profiling():
+    """Start profiling, or stop it and dump the profile under DIAG_DIR (SIGUSR1)."""
+    global _profiler
+    if _profiler is None:
+        if PROFILER == "sample":
+            _profiler = _SamplingProfiler(PROFILE_SAMPLE_INTERVAL)
+        else:
+            import cProfile
+            _profiler = cProfile.Profile()
+        _profiler.enable()
+        log("INFO", "profiling started", profiler=PROFILER)
+        return
+    prof, _profiler = _profiler, None
+    prof.disable()
+    path = _diag_path("profile", "collapsed" if isinstance(prof, _SamplingProfiler) else "pstats")
+    try:
+        if not isinstance(prof, _SamplingProfiler):
+            _open_private(path).close()  # create it 0600; pstats keeps the mode
+        prof.dump_stats(path)
+    except OSError as e:
+        log("WARN", "profile dump failed", path=path, err=f"{e.__class__.__name__}:{e}")
+        return
+    log("INFO", "profiling stopped", path=path)
+
+def toggle_tracing():
+    """Start recording request spans, or stop and dump them under DIAG_DIR (SIGUSR2)."""
+    global _trace_ring
+    if _trace_ring is None:
+        from collections import deque
+        _trace_ring = deque(maxlen=TRACE_RING_SIZE)
+        log("INFO", "tracing started", ring_size=TRACE_RING_SIZE)
+        return
+    ring, _trace_ring = _trace_ring, None
+    import json
+    path = _diag_path("trace", "ndjson")
+    try:
+        with _open_private(path) as f:
+            for rec in ring:
+                f.write(json.dumps(rec, separators=(",", ":")) + "\n")
+    except OSError as e:
+        log("WARN", "trace dump failed", path=path, err=f"{e.__class__.__name__}:{e}")
+        return
+    log("INFO", "tracing stopped", path=path, requests=len(ring))
+
+# Absolute time.time() deadline of the request being handled, or None.
+_deadline = None
+
+class DeadlineExceeded(Exception):
+    """Raised when the current request's client-supplied deadline passes."""
+
+def _parse_deadline(req):
+    """Return the request's deadline as a float, None if absent; raise ValueError if malformed."""
+    value = req.get("deadline")
+    if value is None:
+        return None
+    import math
+    if isinstance(value, bool) or not isinstance(value, (int, float)) or not math.isfinite(value):
+        raise ValueError("deadline must be a UNIX timestamp")
+    return float(value)
+
+def time_remaining():
+    """Seconds left before the current deadline, or None when there is none."""
+    if _deadline is None:
+        return None
+    return _deadline - time.time()
+
+def check_deadline(what):
+    """Raise DeadlineExceeded if the current request's deadline has passed."""
+    left = time_remaining()
+    if left is not None and left <= 0:
+        raise DeadlineExceeded(f"deadline passed before {what}")
+
+def finish_past_deadline(fn, *args, **kw):
+    """Run follow-up work of a zfs operation that already succeeded, ignoring the deadline.
+
+    Stopping here would report TIMEOUT for a change that was made and leave
+    it half done, e.g. a new dataset still owned by root.
+    """
+    global _deadline
+    saved, _deadline = _deadline, None
+    try:
+        return fn(*args, **kw)
+    finally:
+        _deadline = saved
 
 def read_peer_ucred(conn):
     """Return (pid, uid, gid) for a connected UNIX socket peer."""
@@ -60,6 +486,7 @@ def is_user_service(pid, uid):
 
 def uname(uid):
     """Resolve a UID to a username, falling back to the numeric identifier."""
+    import pwd
     try:
         return pwd.getpwuid(uid).pw_name
     except KeyError:
@@ -101,23 +528,80 @@ def load_dataset_rules(path):
         pass
     return entries
 
+POLICY_FILES = {
+    "units":          ("units.list",          load_lines),
+    "mount":          ("mount.list",          load_dataset_rules),
+    "unmount":        ("unmount.list",        load_dataset_rules),
+    "snapshot":       ("snapshot.list",       load_dataset_rules),
+    "rollback":       ("rollback.list",       load_dataset_rules),
+    "create":         ("create.list",         load_dataset_rules),
+    "destroy":        ("destroy.list",        load_dataset_rules),
+    "rename_from":    ("rename.from.list",    load_dataset_rules),
+    "rename_to":      ("rename.to.list",      load_dataset_rules),
+    "setprop":        ("setprop.list",        load_dataset_rules),
+    "setprop.values": ("setprop.values.list", load_lines),
+    "share":          ("share.list",          load_dataset_rules),
+}
+
+# user -> (signature, policy); see cached_policy()
+_policy_cache = {}
+
 def load_policy(user):
     """Collect the policy lists for a user identified by name."""
     base = os.path.join(POLICY_ROOT, user)
-    return {
-        "units":          load_lines(os.path.join(base, "units.list")),
-        "mount":          load_dataset_rules(os.path.join(base, "mount.list")),
-        "unmount":        load_dataset_rules(os.path.join(base, "unmount.list")),
-        "snapshot":       load_dataset_rules(os.path.join(base, "snapshot.list")),
-        "rollback":       load_dataset_rules(os.path.join(base, "rollback.list")),
-        "create":         load_dataset_rules(os.path.join(base, "create.list")),
-        "destroy":        load_dataset_rules(os.path.join(base, "destroy.list")),
-        "rename_from":    load_dataset_rules(os.path.join(base, "rename.from.list")),
-        "rename_to":      load_dataset_rules(os.path.join(base, "rename.to.list")),
-        "setprop":        load_dataset_rules(os.path.join(base, "setprop.list")),
-        "setprop.values": load_lines(os.path.join(base, "setprop.values.list")),
-        "share":          load_dataset_rules(os.path.join(base, "share.list")),
-    }
+    return {key: loader(os.path.join(base, name)) for key, (name, loader) in POLICY_FILES.items()}
+
+def _policy_signature(user, root=None):
+    """Stat the user's policy files; any edit changes the returned signature."""
+    base = os.path.join(root or POLICY_ROOT, user)
+    sig = []
+    for name, _ in POLICY_FILES.values():
+        try:
+            st = os.stat(os.path.join(base, name))
+        except FileNotFoundError:
+            sig.append(None)
+            continue
+        sig.append((st.st_ino, st.st_size, st.st_mtime_ns))
+    return tuple(sig)
+
+def cached_policy(user):
+    """Return the user's policy, re-parsing only when a policy file changed."""
+    sig = _policy_signature(user)
+    hit = _policy_cache.get(user)
+    if hit is not None and hit[0] == sig:
+        return hit[1]
+    p = load_policy(user)
+    _policy_cache[user] = (sig, p)
+    return p
+
+def save_state(path=STATE_PATH):
+    """Persist the parsed policy cache so the next activation starts warm."""
+    state = {"version": STATE_VERSION, "policy_root": POLICY_ROOT, "policies": _policy_cache}
+    tmp = f"{path}.tmp"
+    try:
+        fd = os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, "wb") as f:
+            marshal.dump(state, f)
+        os.replace(tmp, path)
+    except OSError as e:
+        log("WARN", "failed to save state", path=path, err=f"{e.__class__.__name__}:{e}")
+
+def load_state(path=STATE_PATH):
+    """Seed the policy cache from a previous run; entries are re-validated by mtime on use."""
+    try:
+        with open(path, "rb") as f:
+            state = marshal.load(f)
+    except FileNotFoundError:
+        return 0
+    except (OSError, EOFError, ValueError, TypeError) as e:
+        log("WARN", "ignoring unreadable state", path=path, err=f"{e.__class__.__name__}:{e}")
+        return 0
+    if not isinstance(state, dict) or state.get("version") != STATE_VERSION:
+        return 0
+    if state.get("policy_root") != POLICY_ROOT:
+        return 0
+    _policy_cache.update(state.get("policies") or {})
+    return len(_policy_cache)
 
 def list_allows(p, key):
     """Return the allow-list for a given policy key."""
@@ -126,12 +610,15 @@ def list_allows(p, key):
 def dataset_allowed(p, key, user, target):
     """Check whether a dataset glob entry authorizes the user."""
     entries = p.get(key, []) if p else []
-    return any(_dataset_entry_allows(entry, user, target) for entry in entries)
+    with span("dataset_allowed"):
+        return any(_dataset_entry_allows(entry, user, target) for entry in entries)
 
 def _dataset_entry_allows(entry, user, target):
-    actor, pattern = entry
+    actor, pattern = entry[0], entry[1]
     if actor not in (user, "*"):
         return False
+    if len(entry) > 2:
+        return _match_segments(entry[2], target.split("/"))
     return dataset_glob_match(pattern, target)
 
 def dataset_glob_match(pattern, target):
@@ -152,11 +639,222 @@ def _match_parts(pat_parts, tgt_parts):
         return bool(tgt_parts) and _match_parts(pat_parts, tgt_parts[1:])
     if not tgt_parts:
         return False
+    import fnmatch
     if not fnmatch.fnmatchcase(tgt_parts[0], head):
         return False
     return _match_parts(rest, tgt_parts[1:])
 
+# Segment kinds of a compiled dataset glob.
+SEG_LITERAL, SEG_GLOB, SEG_ANY = 0, 1, 2
+POLICY_GLOB_SEGMENT_RE = _LazyRegex(r"^[A-Za-z0-9:_\-.*?\[\]!]+$")
+
+def _compile_glob_segments(pattern):
+    """Translate a dataset glob into (kind, value) segments; regex sources are not yet compiled."""
+    import fnmatch
+    segs = []
+    for part in pattern.split("/"):
+        if part == "**":
+            segs.append((SEG_ANY, ""))
+        elif any(ch in part for ch in "*?["):
+            segs.append((SEG_GLOB, fnmatch.translate(part)))
+        else:
+            segs.append((SEG_LITERAL, part))
+    return tuple(segs)
+
+def _match_segments(segs, tgt_parts):
+    """Compiled counterpart of _match_parts; SEG_GLOB values are compiled regexes."""
+    if not segs:
+        return not tgt_parts
+    kind, value = segs[0]
+    if kind == SEG_ANY:
+        if _match_segments(segs[1:], tgt_parts):
+            return True
+        return bool(tgt_parts) and _match_segments(segs, tgt_parts[1:])
+    if not tgt_parts:
+        return False
+    if kind == SEG_LITERAL:
+        if tgt_parts[0] != value:
+            return False
+    elif value.match(tgt_parts[0]) is None:
+        return False
+    return _match_segments(segs[1:], tgt_parts[1:])
+
+def _check_dataset_rule(user, line):
+    """Validate one '<user> <glob>' line, returning (entry, error)."""
+    parts = line.split(None, 1)
+    if len(parts) < 2:
+        return None, "expected '<user> <dataset-glob>'"
+    actor, pattern = parts[0].strip(), parts[1].strip()
+    if actor not in (user, "*"):
+        return None, f"actor must be '{user}' or '*'"
+    for seg in pattern.split("/"):
+        if not POLICY_GLOB_SEGMENT_RE.fullmatch(seg):
+            return None, f"invalid dataset glob '{pattern}'"
+    return (actor, pattern, _compile_glob_segments(pattern)), None
+
+def _check_setprop_value(line):
+    """Validate one setprop.values rule, returning (rule, error)."""
+    rules = parse_setprop_values([line])
+    if not rules:
+        return None, "expected 'key=value' or 'mountpoint:glob'"
+    key, value, glob = rules[0]
+    if key not in PROP_KEY_ALLOW:
+        return None, f"property '{key}' is not settable"
+    if glob is not None and key != "mountpoint":
+        return None, "':glob' rules only apply to mountpoint"
+    if not (value or glob):
+        return None, "empty value"
+    return rules[0], None
+
+def _read_policy_lines(path, errors):
+    """Yield (lineno, line) for non-blank, non-comment lines of a policy file.
+
+    A missing file is an empty list; any other read error is appended to errors.
+    """
+    try:
+        with open(path, "r") as f:
+            for lineno, raw in enumerate(f, 1):
+                line = raw.strip()
+                if line and not line.startswith("#"):
+                    yield lineno, line
+    except FileNotFoundError:
+        return
+    except (OSError, UnicodeDecodeError) as e:
+        errors.append(f"{path}: {getattr(e, 'strerror', None) or e}")
+
+def compile_user_policy(root, user):
+    """Strictly parse one user's policy directory into (policy, errors)."""
+    base = os.path.join(root, user)
+    policy = {}
+    errors = []
+    for key, (name, loader) in POLICY_FILES.items():
+        path = os.path.join(base, name)
+        entries = []
+        for lineno, line in _read_policy_lines(path, errors):
+            if loader is load_dataset_rules:
+                entry, err = _check_dataset_rule(user, line)
+            elif key == "setprop.values":
+                entry, err = line, _check_setprop_value(line)[1]
+            elif any(ch.isspace() for ch in line):
+                entry, err = None, "unit glob must not contain whitespace"
+            else:
+                entry, err = line, None
+            if err:
+                errors.append(f"{path}:{lineno}: {err}")
+            else:
+                entries.append(entry)
+        policy[key] = entries
+    policy["setprop.rules"] = parse_setprop_values(policy["setprop.values"])
+    return policy, errors
+
+def compile_policy(root=POLICY_ROOT):
+    """Validate every user under root; return (artifact, errors)."""
+    users = {}
+    sources = {}
+    errors = []
+    try:
+        names = sorted(os.listdir(root))
+    except OSError as e:
+        return None, [f"{root}: {e.strerror or e}"]
+    for user in names:
+        if not os.path.isdir(os.path.join(root, user)):
+            continue
+        sources[user] = _policy_signature(user, root)
+        policy, errs = compile_user_policy(root, user)
+        users[user] = policy
+        errors.extend(errs)
+    artifact = {
+        "format": COMPILED_POLICY_FORMAT,
+        "version": COMPILED_POLICY_VERSION,
+        "policy_root": root,
+        "sources": sources,
+        "users": users,
+    }
+    return artifact, errors
+
+def write_compiled_policy(artifact, path=COMPILED_POLICY_PATH):
+    """Atomically write a compiled policy artifact."""
+    tmp = f"{path}.tmp"
+    fd = os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+    with os.fdopen(fd, "wb") as f:
+        marshal.dump(artifact, f)
+    os.replace(tmp, path)
+
+def load_compiled_policy(path=COMPILED_POLICY_PATH):
+    """Load a compiled artifact into ({user: policy}, {user: signature}) with glob regexes compiled.
+
+    The signatures are the policy.d stat signatures the artifact was compiled
+    from; see compiled_policy_stale(). Raises FileNotFoundError when absent and
+    ValueError when the artifact is malformed or was written by an
+    incompatible version.
+    """
+    import re
+    with open(path, "rb") as f:
+        try:
+            artifact = marshal.loads(f.read())
+        except (EOFError, TypeError) as e:
+            raise ValueError(f"unreadable policy artifact: {e}")
+    if not isinstance(artifact, dict) or artifact.get("format") != COMPILED_POLICY_FORMAT:
+        raise ValueError("not a zfs-helper policy artifact")
+    if artifact.get("version") != COMPILED_POLICY_VERSION:
+        raise ValueError(f"unsupported policy artifact version {artifact.get('version')}")
+    users = artifact.get("users") or {}
+    for policy in users.values():
+        for key, (_, loader) in POLICY_FILES.items():
+            if loader is not load_dataset_rules:
+                continue
+            policy[key] = [
+                (actor, pattern, tuple((kind, re.compile(value) if kind == SEG_GLOB else value)
+                                       for kind, value in segs))
+                for actor, pattern, segs in policy.get(key, [])
+            ]
+    return users, artifact.get("sources") or {}
+
+def compiled_policy_stale(sources, user):
+    """True when the user's policy.d files differ from those the artifact was compiled from."""
+    return _policy_signature(user) != sources.get(user, (None,) * len(POLICY_FILES))
+
+# (stat signature, (users, sources)) of the loaded artifact; see policy_for()
+_compiled = [None, None]
+# Users already warned about for the loaded artifact being stale.
+_compiled_stale = set()
+
+def _compiled_users():
+    """Return the compiled artifact's (users, sources), reloading when the file changes, or None."""
+    try:
+        st = os.stat(COMPILED_POLICY_PATH)
+    except FileNotFoundError:
+        _compiled[:] = [None, None]
+        return None
+    sig = (st.st_ino, st.st_size, st.st_mtime_ns)
+    if _compiled[0] != sig:
+        try:
+            loaded = load_compiled_policy(COMPILED_POLICY_PATH)
+        except (OSError, ValueError) as e:
+            log("WARN", "ignoring compiled policy", path=COMPILED_POLICY_PATH, err=f"{e.__class__.__name__}:{e}")
+            loaded = None
+        _compiled[:] = [sig, loaded]
+        _compiled_stale.clear()
+    return _compiled[1]
+
+def policy_for(user):
+    """Return the user's policy from the compiled artifact, else from policy.d.
+
+    policy.d wins whenever the user's files changed after the artifact was
+    compiled, so a revocation applies without waiting for a recompile.
+    """
+    compiled = _compiled_users()
+    if compiled is not None:
+        users, sources = compiled
+        if not compiled_policy_stale(sources, user):
+            return users.get(user, {})
+        if user not in _compiled_stale:
+            _compiled_stale.add(user)
+            log("WARN", "compiled policy is stale; using policy.d", path=COMPILED_POLICY_PATH, user=user)
+    return cached_policy(user)
+
 def _user_ids(uid):
+    import pwd
     try:
         pw = pwd.getpwuid(uid)
     except KeyError:
@@ -169,7 +867,7 @@ def _dataset_mountpoint(dataset):
         log("WARN", "mountpoint lookup failed", dataset=dataset, err=(err or f"rc={rc}"))
         return None
     mountpoint = (out.splitlines()[0] if out else "").strip()
-    if mountpoint in {"", "legacy", "none", "-"}:
+    if mountpoint in UNMOUNTABLE_MOUNTPOINTS:
         return None
     return mountpoint
 
@@ -182,6 +880,7 @@ def _list_descendant_filesystems(dataset):
     return names or [dataset]
 
 def _safe_chown(path, uid, gid):
+    """chown (lchown for symlinks) path, returning the OSError instead of raising."""
     try:
         if os.path.islink(path):
             os.lchown(path, uid, gid)
@@ -189,20 +888,32 @@ def _safe_chown(path, uid, gid):
             os.chown(path, uid, gid)
     except FileNotFoundError:
         pass
-    except PermissionError as e:
-        log("WARN", "chown permission error", path=path, err=f"{e.__class__.__name__}:{e}")
     except OSError as e:
-        log("WARN", "chown failed", path=path, err=f"{e.__class__.__name__}:{e}")
+        return e
+    return None
 
 def _chown_recursive(path, uid, gid):
+    """Chown a tree, logging one summary per error type rather than one line per file."""
     if not os.path.exists(path):
         return
-    _safe_chown(path, uid, gid)
-    for root, dirs, files in os.walk(path, topdown=True, followlinks=False):
-        for name in dirs:
-            _safe_chown(os.path.join(root, name), uid, gid)
-        for name in files:
-            _safe_chown(os.path.join(root, name), uid, gid)
+    failures = {}
+
+    def chown(target):
+        err = _safe_chown(target, uid, gid)
+        if err is not None:
+            kind = err.__class__.__name__
+            count, first_path, first_err = failures.get(kind, (0, target, err))
+            failures[kind] = (count + 1, first_path, first_err)
+
+    with span("chown"):
+        chown(path)
+        for root, dirs, files in os.walk(path, topdown=True, followlinks=False):
+            for name in dirs:
+                chown(os.path.join(root, name))
+            for name in files:
+                chown(os.path.join(root, name))
+    for kind, (count, first_path, first_err) in failures.items():
+        log("WARN", "chown failed", root=path, count=count, first_path=first_path, err=f"{kind}:{first_err}")
 
 def _apply_dataset_tree_ownership(dataset, uid):
     ids = _user_ids(uid)
@@ -242,6 +953,8 @@ def _apply_snapshot_ownership(dataset, snapshot, uid, recursive=False):
 
 def user_in_zfshelper_group(uid):
     """Verify that the caller belongs to the zfshelper group."""
+    import grp
+    import pwd
     try:
         user = pwd.getpwuid(uid)
     except KeyError:
@@ -256,10 +969,18 @@ def user_in_zfshelper_group(uid):
 
 def zfs_ok(args):
     """Execute a zfs(8) command and return success flag plus output."""
+    # trunk-ignore(bandit/B404)
+    import subprocess
+    check_deadline(f"zfs {args[0]}")
+    timeout = None if args[0] in RUN_TO_COMPLETION_VERBS else time_remaining()
     try:
-        # trunk-ignore(bandit/B603)
-        res = subprocess.run([ZFS_BIN] + args, capture_output=True, text=True)
+        with span(f"zfs {args[0]}"):
+            # trunk-ignore(bandit/B603)
+            res = subprocess.run([ZFS_BIN] + args, capture_output=True, text=True, timeout=timeout)
         return (res.returncode == 0, res.stdout.strip(), res.stderr.strip(), res.returncode)
+    except subprocess.TimeoutExpired:
+        # subprocess.run() has already killed and reaped the child.
+        raise DeadlineExceeded(f"zfs {args[0]} killed at deadline")
     except Exception as e:
         return (False, "", str(e), 127)
 
@@ -277,18 +998,146 @@ def handle_mount(p, user, ds):
         return deny("DENY_POLICY")
     return allow_or_error(*zfs_ok(["mount", ds]))
 
+def _unmount_policy_key(p):
+    """Unmount falls back to the mount allow-list when unmount.list is empty."""
+    return "unmount" if list_allows(p, "unmount") else "mount"
+
 def handle_unmount(p, user, ds):
     if not DATASET_RE.fullmatch(ds):
         return deny("INVALID_DATASET")
-    unmount_entries = list_allows(p, "unmount")
-    if unmount_entries:
-        allowed = dataset_allowed(p, "unmount", user, ds)
-    else:
-        allowed = dataset_allowed(p, "mount", user, ds)
-    if not allowed:
+    if not dataset_allowed(p, _unmount_policy_key(p), user, ds):
         return deny("DENY_POLICY")
     return allow_or_error(*zfs_ok(["umount", ds]))
 
+def _list_filesystem_states():
+    """Return {name: (mounted, canmount, mountpoint)} for every filesystem from one zfs list call."""
+    ok, out, err, rc = zfs_ok(["list", "-H", "-o", "name,mounted,canmount,mountpoint", "-t", "filesystem"])
+    if not ok:
+        log("WARN", "filesystem listing failed", err=(err or f"rc={rc}"))
+        return None
+    states = {}
+    for line in out.splitlines():
+        parts = line.split("\t")
+        if len(parts) != 4:
+            continue
+        name, mounted, canmount, mountpoint = (part.strip() for part in parts)
+        states[name] = (mounted == "yes", canmount, mountpoint)
+    return states
+
+def _nearest_selected_ancestor(ds, selected):
+    parts = ds.split("/")
+    for i in range(len(parts) - 1, 0, -1):
+        parent = "/".join(parts[:i])
+        if parent in selected:
+            return parent
+    return None
+
+def _run_by_hierarchy(datasets, op, children_first=False):
+    """Run op on each dataset in parallel, ordering parents before children.
+
+    With children_first the order is reversed so a dataset only runs once all
+    of its selected descendants have finished. Independent subtrees proceed
+    concurrently. When a prerequisite fails its dependents are skipped.
+    """
+    from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+    selected = set(datasets)
+    deps = {ds: set() for ds in datasets}
+    for ds in datasets:
+        parent = _nearest_selected_ancestor(ds, selected)
+        if parent is None:
+            continue
+        if children_first:
+            deps[parent].add(ds)
+        else:
+            deps[ds].add(parent)
+    dependents = {ds: [] for ds in datasets}
+    for ds, prereqs in deps.items():
+        for prereq in prereqs:
+            dependents[prereq].append(ds)
+
+    results = {}
+
+    def skip(ds, failed):
+        if ds in results:
+            return
+        results[ds] = ("SKIPPED", f"{failed} not completed")
+        for nxt in dependents[ds]:
+            skip(nxt, ds)
+
+    with ThreadPoolExecutor(max_workers=BULK_WORKERS) as pool:
+        running = {pool.submit(op, ds): ds for ds in sorted(datasets) if not deps[ds]}
+        while running:
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for fut in done:
+                ds = running.pop(fut)
+                results[ds] = fut.result()
+                for nxt in dependents[ds]:
+                    if results[ds][0] != "OK":
+                        skip(nxt, ds)
+                        continue
+                    deps[nxt].discard(ds)
+                    if not deps[nxt] and nxt not in results:
+                        running[pool.submit(op, nxt)] = nxt
+    return results
+
+def _bulk_zfs(verb):
+    """Per-dataset operation for _run_by_hierarchy; a passed deadline becomes a TIMEOUT result."""
+    def op(ds):
+        try:
+            return allow_or_error(*zfs_ok([verb, ds]))
+        except DeadlineExceeded as e:
+            return ("TIMEOUT", str(e))
+    return op
+
+def _bulk_report(results):
+    """Fold per-dataset results into a single (status, info) response."""
+    statuses = {status for status, _ in results.values()}
+    info = [{"dataset": ds, "status": status, "info": info}
+            for ds, (status, info) in sorted(results.items())]
+    if "TIMEOUT" in statuses:
+        return "TIMEOUT", info
+    return ("ERROR" if statuses - {"OK", "SKIPPED"} else "OK"), info
+
+def handle_mount_all(p, user):
+    """Mount every unmounted dataset the caller's mount.list permits."""
+    states = _list_filesystem_states()
+    if states is None:
+        return ("ERROR", "zfs list failed")
+    results = {}
+    pending = []
+    for ds, (mounted, canmount, mountpoint) in states.items():
+        if not dataset_allowed(p, "mount", user, ds):
+            continue
+        if mounted:
+            results[ds] = ("OK", "already mounted")
+        elif mountpoint in UNMOUNTABLE_MOUNTPOINTS:
+            # Not in the dependency graph, so its children do not wait on it.
+            results[ds] = ("SKIPPED", f"mountpoint={mountpoint or '-'}")
+        elif canmount == "off":
+            results[ds] = ("SKIPPED", "canmount=off")
+        else:
+            pending.append(ds)
+    results.update(_run_by_hierarchy(pending, _bulk_zfs("mount")))
+    return _bulk_report(results)
+
+def handle_unmount_all(p, user):
+    """Unmount every mounted dataset the caller may unmount, children first."""
+    states = _list_filesystem_states()
+    if states is None:
+        return ("ERROR", "zfs list failed")
+    key = _unmount_policy_key(p)
+    results = {}
+    pending = []
+    for ds, (mounted, _, mountpoint) in states.items():
+        if not mounted or not dataset_allowed(p, key, user, ds):
+            continue
+        if mountpoint in UNMOUNTABLE_MOUNTPOINTS:
+            results[ds] = ("SKIPPED", f"mountpoint={mountpoint or '-'}")
+        else:
+            pending.append(ds)
+    results.update(_run_by_hierarchy(pending, _bulk_zfs("umount"), children_first=True))
+    return _bulk_report(results)
+
 def handle_snapshot(p, user, uid, tgt, rec=False):
     """Create snapshots under permitted datasets."""
     if not SNAP_RE.fullmatch(tgt):
@@ -304,7 +1153,7 @@ def handle_snapshot(p, user, uid, tgt, rec=False):
     status, info = allow_or_error(ok, out, err, rc)
     if ok:
         snap_name = tgt.split("@", 1)[1]
-        _apply_snapshot_ownership(ds, snap_name, uid, recursive=rec)
+        finish_past_deadline(_apply_snapshot_ownership, ds, snap_name, uid, recursive=rec)
     return status, info
 
 def handle_rollback(p, user, uid, snap, rec=False, force=False):
@@ -335,7 +1184,7 @@ def handle_create(p, user, uid, ds, props=None):
     ok, out, err, rc = zfs_ok(args)
     status, info = allow_or_error(ok, out, err, rc)
     if ok:
-        _apply_single_dataset_ownership(ds, uid)
+        finish_past_deadline(_apply_single_dataset_ownership, ds, uid)
     return status, info
 
 def handle_destroy(p, user, uid, tgt, rec=False, force=False):
@@ -366,7 +1215,7 @@ def handle_rename(p, user, uid, src, dst):
     ok, out, err, rc = zfs_ok(["rename", src, dst])
     status, info = allow_or_error(ok, out, err, rc)
     if ok:
-        _apply_dataset_tree_ownership(dst, uid)
+        finish_past_deadline(_apply_dataset_tree_ownership, dst, uid)
     return status, info
 
 def parse_setprop_values(lines):
@@ -408,6 +1257,8 @@ def _value_allowed_by_rules(rules, key, value):
     if not rules:
         return _check_builtin_rules(key, value)
 
+    import fnmatch
+
     for (k, v, g) in rules:
         if k != key:
             continue
@@ -426,7 +1277,9 @@ def handle_setprop(p, user, ds, key, value):
     if not _setprop_policy_allows(p, user, ds):
         return deny("DENY_POLICY")
 
-    rules = parse_setprop_values(list_allows(p, "setprop.values"))
+    rules = p.get("setprop.rules") if p else None
+    if rules is None:
+        rules = parse_setprop_values(list_allows(p, "setprop.values"))
     if not _value_allowed_by_rules(rules, key, value):
         return deny("DENY_PROP_VALUE")
 
@@ -442,11 +1295,18 @@ def handle_share(p, user, ds):
 
 def send(conn, status, info):
     """Emit a JSON response to the requester."""
+    import json
+    trace_note(status=status)
     payload = json.dumps({"status": status, "info": info}, separators=(",",":")) + "\n"
-    conn.sendall(payload.encode())
+    try:
+        conn.sendall(payload.encode())
+    except (BrokenPipeError, ConnectionResetError):
+        # The client gave up (typically at its deadline); the outcome is still logged.
+        pass
 
 def parse_request(raw):
     """Decode a JSON request payload into a dictionary."""
+    import json
     try:
         return json.loads(raw)
     except Exception:
@@ -459,6 +1319,10 @@ def handle_action(p, req, user, uid):
         return handle_mount(p, user, req.get("dataset", ""))
     elif a == "unmount":
         return handle_unmount(p, user, req.get("dataset", ""))
+    elif a == "mount-all":
+        return handle_mount_all(p, user)
+    elif a == "unmount-all":
+        return handle_unmount_all(p, user)
     elif a == "snapshot":
         return handle_snapshot(p, user, uid, req.get("target", ""), bool(req.get("recursive", False)))
     elif a == "rollback":
@@ -477,19 +1341,25 @@ def handle_action(p, req, user, uid):
 
 def validate_request(pid, uid, caller, conn):
     """Run authentication and policy checks before executing an action."""
-    ok, unit = is_user_service(pid, uid)
+    with span("user_service"):
+        ok, unit = is_user_service(pid, uid)
+    trace_note(unit=unit)
     # Immediately reject callers who are not systemd user services.
     if not ok:
         send(conn, "DENY_NOT_USER_SERVICE", "")
         log("DENY","not a user service",peer_pid=pid,peer_uid=uid,peer_user=caller)
         return None, None
-    p = load_policy(caller)
+    import fnmatch
+    with span("policy"):
+        p = policy_for(caller)
     units = list_allows(p, "units")
     if not units or not any(fnmatch.fnmatch(unit, pat) for pat in units):
         send(conn, "DENY_UNIT", unit or "")
         log("DENY","unit not allowed",unit=(unit or "unknown"),peer_uid=uid,peer_user=caller)
         return None, None
-    if not user_in_zfshelper_group(uid):
+    with span("group"):
+        in_group = user_in_zfshelper_group(uid)
+    if not in_group:
         send(conn, "DENY_GROUP", "")
         log("DENY","user not in zfshelper group",peer_uid=uid,peer_user=caller,unit=unit)
         return None, None
@@ -497,18 +1367,43 @@ def validate_request(pid, uid, caller, conn):
 
 def handle(conn):
     """Receive, validate, and process a single connection."""
+    global _trace_req, _deadline
+    ring = _trace_ring
+    capture = _capture_file is not None
+    if ring is not None or capture:
+        _trace_req = {"ts": round(time.time(), 6), "t0": time.monotonic()}
+        if ring is not None:
+            _trace_req["spans"] = []
+    try:
+        _handle(conn)
+    finally:
+        _deadline = None
+        req, _trace_req = _trace_req, None
+        if req is not None:
+            req["total_ms"] = round((time.monotonic() - req.pop("t0")) * 1000, 3)
+            if capture:
+                _write_capture(req)
+            if ring is not None:
+                ring.append(req)
+
+def _handle(conn):
+    global _deadline
+    started = time.monotonic()
     pid, uid, _ = read_peer_ucred(conn)
     caller = uname(uid)
+    trace_note(peer_uid=uid, peer_user=caller)
     data = b""
-    while True:
-        chunk = conn.recv(4096)
-        if not chunk:
-            break
-        data += chunk
-        if len(data) > 8192:
-            break
+    with span("recv"):
+        while True:
+            chunk = conn.recv(4096)
+            if not chunk:
+                break
+            data += chunk
+            if len(data) > 8192:
+                break
     req_s = data.decode("utf-8", errors="replace").strip()
-    req = parse_request(req_s)
+    with span("parse"):
+        req = parse_request(req_s)
     if not req or "action" not in req:
         send(conn, "BAD_REQUEST", "expect JSON with 'action'")
         log("DENY","bad request",peer_pid=pid,peer_uid=uid,peer_user=caller)
@@ -517,25 +1412,90 @@ def handle(conn):
         send(conn, "DENY_ROOT", "")
         log("DENY","root caller not allowed",peer_pid=pid,peer_uid=uid,peer_user=caller)
         return
+    trace_note(action=req["action"])
+    if _trace_req is not None:
+        trace_note(request=_capture_request(req))
+    try:
+        _deadline = _parse_deadline(req)
+    except ValueError as e:
+        send(conn, "BAD_REQUEST", str(e))
+        log("DENY","bad request",peer_pid=pid,peer_uid=uid,peer_user=caller,err=str(e))
+        return
+    if _deadline is not None and time.time() >= _deadline:
+        # Expired while queued behind earlier requests; the client has given up.
+        send(conn, "TIMEOUT", "deadline expired before processing")
+        log("ERROR", req["action"], action=req["action"], peer_uid=uid, peer_user=caller, status="TIMEOUT",
+            duration=f"{time.monotonic() - started:.6f}", info="expired_in_queue")
+        return
 
-    p, unit = validate_request(pid, uid, caller, conn)
+    with span("validate"):
+        p, unit = validate_request(pid, uid, caller, conn)
     if p is None:
         return
 
-    status, info = handle_action(p, req, caller, uid)
-    send(conn, status, info)
+    with span("action"):
+        try:
+            status, info = handle_action(p, req, caller, uid)
+        except DeadlineExceeded as e:
+            status, info = "TIMEOUT", str(e)
+    with span("send"):
+        send(conn, status, info)
+    if not isinstance(info, str):
+        import json
+        info = json.dumps(info, separators=(",",":"))
     if status == "OK":
         lvl = "ALLOW"
     elif status.startswith("DENY"):
         lvl = "DENY"
     else:
         lvl = "ERROR"
-    log(lvl, req["action"], unit=unit, peer_uid=uid, peer_user=caller, status=status, info=info.replace(" ", "_")[:200])
+    log(lvl, req["action"], action=req["action"], unit=unit, peer_uid=uid, peer_user=caller, status=status,
+        duration=f"{time.monotonic() - started:.6f}", info=info.replace(" ", "_")[:200])
+
+def process_age():
+    """Seconds since the kernel started this process, interpreter start-up included."""
+    try:
+        with open("/proc/self/stat", "rb") as f:
+            stat = f.read()
+        # Field 22 (starttime, in clock ticks since boot); comm may contain spaces.
+        start_ticks = int(stat.rsplit(b")", 1)[1].split()[19])
+    except (OSError, ValueError, IndexError):
+        return time.monotonic() - START_TIME
+    return time.clock_gettime(time.CLOCK_BOOTTIME) - start_ticks / os.sysconf("SC_CLK_TCK")
+
+# Signals received but not yet acted on; see _defer_signal().
+_pending_signals = []
+
+def _defer_signal(signum, frame):
+    """Record a signal for the accept loop; the wakeup fd interrupts its select()."""
+    _pending_signals.append(signum)
+
+def _handle_pending_signals():
+    """Act on deferred signals from the accept loop; return True to shut down."""
+    import signal
+    stop = False
+    while _pending_signals:
+        signum = _pending_signals.pop(0)
+        if signum == signal.SIGTERM:
+            log("INFO", "SIGTERM received, exiting")
+            stop = True
+        elif signum == signal.SIGUSR1:
+            toggle_profiling()
+        elif signum == signal.SIGUSR2:
+            toggle_tracing()
+    return stop
 
 def main():
-    """Accept UNIX socket connections and service requests indefinitely."""
+    """Accept UNIX socket connections and service requests.
+
+    When socket-activated the daemon exits after IDLE_TIMEOUT seconds without
+    a connection; systemd restarts it on the next one. SIGTERM also leaves the
+    loop once the current request is done. The policy cache is saved and the
+    log queue flushed on exit; the cache is reloaded on start.
+    """
     listen_fds = int(os.environ.get("LISTEN_FDS", "0"))
-    if listen_fds == 1 and 3 in (3,):
+    activated = listen_fds == 1
+    if activated:
         sock = socket.socket(fileno=3)
     else:
         if os.path.exists(SOCK_PATH):
@@ -545,20 +1505,91 @@ def main():
         # trunk-ignore(bandit/B103)
         os.chmod(SOCK_PATH, 0o660) # group read/write is necessary
         try:
+            import grp
             os.chown(SOCK_PATH, 0, grp.getgrnam("zfshelper").gr_gid)
         except Exception as e:
             log("WARN", "failed to adjust socket ownership", err=f"{e.__class__.__name__}:{e}")
         sock.listen(16)
+    import select
+    import signal
+    wake_r, wake_w = os.pipe()
+    os.set_blocking(wake_r, False)
+    os.set_blocking(wake_w, False)
+    signal.set_wakeup_fd(wake_w)
+    # Handlers only record the signal: logging or dumping from a handler could
+    # re-enter the log writer's lock on the same thread and deadlock.
+    for signum in (signal.SIGTERM, signal.SIGUSR1, signal.SIGUSR2):
+        signal.signal(signum, _defer_signal)
+    if CAPTURE_PATH:
+        open_capture()
+    warm = load_state()
+    log("INFO", "ready", activated=activated, cached_policies=warm,
+        startup_ms=f"{process_age() * 1000:.1f}")
+    first = True
+    idle = activated and IDLE_TIMEOUT > 0
+    idle_until = time.monotonic() + IDLE_TIMEOUT
     while True:
         try:
+            if _pending_signals and _handle_pending_signals():
+                break
+            timeout = max(0.0, idle_until - time.monotonic()) if idle else None
+            ready, _, _ = select.select([sock, wake_r], [], [], timeout)
+            if not ready:
+                log("INFO", "idle timeout, exiting", idle_s=IDLE_TIMEOUT)
+                break
+            if wake_r in ready:
+                os.read(wake_r, 512)
+            if sock not in ready:
+                continue
             conn, _ = sock.accept()
             with conn:
                 handle(conn)
+            if first:
+                # Activation exists to serve this request: report it from process
+                # start, including the lazy imports it paid for.
+                first = False
+                log("INFO", "first request served", first_request_ms=f"{process_age() * 1000:.1f}")
+            idle_until = time.monotonic() + IDLE_TIMEOUT
         except KeyboardInterrupt:
             break
         except Exception as e:
             log("ERROR", f"server exception: {e.__class__.__name__}:{e}")
             time.sleep(0.05)
+    if _profiler is not None:
+        toggle_profiling()
+    if _trace_ring is not None:
+        toggle_tracing()
+    save_state()
+    if _log_writer is not None:
+        _log_writer.close()
+
+def compile_main(argv):
+    """Command-line entry point for the offline policy compiler."""
+    import argparse
+    import sys
+    parser = argparse.ArgumentParser(prog="zfs-helper.py --compile-policy",
+                                     description="Validate policy.d and write a compiled policy artifact.")
+    parser.add_argument("--policy-root", default=POLICY_ROOT, help=f"Policy directory (default: {POLICY_ROOT})")
+    parser.add_argument("--output", default=COMPILED_POLICY_PATH, help=f"Artifact path (default: {COMPILED_POLICY_PATH})")
+    parser.add_argument("--check", action="store_true", help="Validate only; do not write the artifact")
+    args = parser.parse_args(argv)
+    artifact, errors = compile_policy(args.policy_root)
+    for err in errors:
+        print(f"error: {err}", file=sys.stderr)
+    if errors:
+        print(f"{len(errors)} error(s); artifact not written", file=sys.stderr)
+        return 1
+    if not args.check:
+        try:
+            write_compiled_policy(artifact, args.output)
+        except OSError as e:
+            print(f"error: {args.output}: {e.strerror or e}", file=sys.stderr)
+            return 1
+        print(f"compiled {len(artifact['users'])} user policies to {args.output}")
+    return 0
 
 if __name__ == "__main__":
+    import sys
+    if sys.argv[1:2] == ["--compile-policy"]:
+        sys.exit(compile_main(sys.argv[2:]))
     main()
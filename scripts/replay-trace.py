@@ -0,0 +1,221 @@
+#!/usr/bin/env python3
+"""Replay a captured zfs-helper request trace against one or two daemon builds.
+
+Capture a trace by running the daemon with ZFS_HELPER_CAPTURE=/path/trace.ndjson.
+Each build is loaded from its zfs-helper.py and driven through its real
+handle() path over socket pairs by a single serial server thread, mirroring the
+daemon's accept loop. Kernel peer credentials and the systemd cgroup check are
+replaced by the uid, user and unit recorded in the trace. zfs(8) is replaced by
+a stand-in binary and policy comes from a copied policy.d, so replaying is safe
+on a development machine.
+"""
+
+from __future__ import annotations
+
+import argparse
+import contextlib
+import importlib.machinery
+import importlib.util
+import json
+import os
+import queue
+import socket
+import sys
+import threading
+import time
+from collections import Counter
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+
+def load_trace(path: Path) -> List[dict]:
+    records = []
+    with path.open("r", encoding="utf-8") as f:
+        for lineno, raw in enumerate(f, 1):
+            line = raw.strip()
+            if not line:
+                continue
+            try:
+                rec = json.loads(line)
+            except ValueError as exc:
+                raise RuntimeError(f"{path}:{lineno}: {exc}")
+            if not isinstance(rec.get("req"), dict) or rec.get("uid") is None:
+                continue
+            records.append(rec)
+    records.sort(key=lambda r: r["ts"])
+    return records
+
+
+def load_build(path: Path, name: str, zfs_bin: str, policy_root: str, policy_artifact: Optional[str]) -> object:
+    # An explicit loader lets builds be given as files without a .py suffix.
+    loader = importlib.machinery.SourceFileLoader(name, str(path))
+    spec = importlib.util.spec_from_file_location(name, path, loader=loader)
+    if spec is None or spec.loader is None:
+        raise RuntimeError(f"Unable to load helper module at {path}")
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    module.ZFS_BIN = zfs_bin
+    module.POLICY_ROOT = policy_root
+    if hasattr(module, "COMPILED_POLICY_PATH"):
+        module.COMPILED_POLICY_PATH = policy_artifact or str(Path(policy_root) / ".no-compiled-policy")
+    if hasattr(module, "LOG_TARGET"):
+        # Log to stdout like builds that predate LOG_TARGET; replay() sends stdout
+        # to the same sink for every build so each pays a comparable logging cost.
+        module.LOG_TARGET = "stdout"
+    return module
+
+
+def install_identity(module: object, current: Dict[str, dict]) -> None:
+    """Answer the daemon's authentication hooks from the record being replayed."""
+    module.read_peer_ucred = lambda conn: (0, current["rec"]["uid"], current["rec"]["uid"])
+    module.uname = lambda uid: current["rec"].get("user") or f"uid{uid}"
+    module.is_user_service = lambda pid, uid: (current["rec"].get("unit") is not None, current["rec"].get("unit"))
+    module.user_in_zfshelper_group = lambda uid: True
+
+
+def read_response(client: socket.socket, chunks: List[bytes]) -> None:
+    """Read the client end until the server closes it."""
+    with client:
+        while True:
+            data = client.recv(65536)
+            if not data:
+                return
+            chunks.append(data)
+
+
+def replay(module: object, records: List[dict], speed: float) -> Tuple[List[float], Counter, float]:
+    """Send records at their captured pace divided by speed (0 = back to back).
+
+    When paced, latency runs from a request's scheduled send time to the server
+    finishing it, so time spent queued behind slower requests counts, as it does
+    for real clients. Back to back, latency is service time only. The build's
+    log output, printed or written by a log thread, is discarded to os.devnull.
+    """
+    current: Dict[str, dict] = {}
+    install_identity(module, current)
+    inbox: "queue.Queue[Optional[Tuple[socket.socket, socket.socket, dict, Optional[float]]]]" = queue.Queue()
+    latencies: List[float] = []
+    statuses: Counter = Counter()
+
+    def serve() -> None:
+        while True:
+            item = inbox.get()
+            if item is None:
+                return
+            server, client, rec, scheduled = item
+            current["rec"] = rec
+            if scheduled is None:
+                scheduled = time.monotonic()
+            # Drain the response while handle() writes it, so a reply larger
+            # than the socket buffer cannot block sendall().
+            chunks: List[bytes] = []
+            reader = threading.Thread(target=read_response, args=(client, chunks), daemon=True)
+            reader.start()
+            with server:
+                module.handle(server)
+            latencies.append((time.monotonic() - scheduled) * 1000)
+            reader.join()
+            raw = b"".join(chunks)
+            try:
+                statuses[json.loads(raw)["status"]] += 1
+            except (ValueError, KeyError):
+                statuses["NO_RESPONSE"] += 1
+
+    worker = threading.Thread(target=serve, daemon=True)
+    worker.start()
+    origin = records[0]["ts"] if records else 0.0
+    start = time.monotonic()
+    with open(os.devnull, "w") as sink, contextlib.redirect_stdout(sink):
+        for rec in records:
+            scheduled = None
+            if speed > 0:
+                scheduled = start + (rec["ts"] - origin) / speed
+                delay = scheduled - time.monotonic()
+                if delay > 0:
+                    time.sleep(delay)
+            client, server = socket.socketpair()
+            client.sendall(json.dumps(rec["req"], separators=(",", ":")).encode())
+            client.shutdown(socket.SHUT_WR)
+            inbox.put((server, client, rec, scheduled))
+        inbox.put(None)
+        worker.join()
+        elapsed = time.monotonic() - start
+        writer = getattr(module, "_log_writer", None)
+        if writer is not None:
+            writer.close()
+    return latencies, statuses, elapsed
+
+
+def percentile(values: List[float], pct: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, int(round(pct / 100.0 * len(ordered))) - 1))
+    return ordered[index]
+
+
+def summarize(latencies: List[float], elapsed: float) -> Dict[str, float]:
+    return {
+        "requests": float(len(latencies)),
+        "throughput_rps": len(latencies) / elapsed if elapsed > 0 else 0.0,
+        "p50_ms": percentile(latencies, 50),
+        "p90_ms": percentile(latencies, 90),
+        "p99_ms": percentile(latencies, 99),
+        "max_ms": max(latencies) if latencies else 0.0,
+    }
+
+
+def print_report(results: Dict[str, Tuple[Dict[str, float], Counter]]) -> None:
+    names = list(results)
+    header = f"{'metric':<16}" + "".join(f"{name:>14}" for name in names)
+    if len(names) == 2:
+        header += f"{'delta':>10}"
+    print(header)
+    for metric in ("requests", "throughput_rps", "p50_ms", "p90_ms", "p99_ms", "max_ms"):
+        values = [results[name][0][metric] for name in names]
+        row = f"{metric:<16}" + "".join(f"{value:>14.2f}" for value in values)
+        if len(values) == 2 and values[0]:
+            row += f"{(values[1] - values[0]) / values[0] * 100:>+9.1f}%"
+        print(row)
+    for name in names:
+        counts = ", ".join(f"{status}={count}" for status, count in sorted(results[name][1].items()))
+        print(f"statuses[{name}]: {counts}")
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Replay a zfs-helper request trace and report throughput and tail latency.")
+    parser.add_argument("trace", type=Path, help="NDJSON trace written by ZFS_HELPER_CAPTURE")
+    parser.add_argument("--baseline", type=Path, required=True, help="zfs-helper.py of the reference build")
+    parser.add_argument("--candidate", type=Path, help="zfs-helper.py of the build to compare against the baseline")
+    parser.add_argument("--policy-root", required=True, help="Copy of policy.d to evaluate requests against")
+    parser.add_argument("--policy-artifact", help="Compiled policy to use instead of --policy-root")
+    parser.add_argument("--zfs-bin", default="/bin/true", help="Stand-in zfs binary (default: /bin/true)")
+    parser.add_argument("--speed", type=float, default=1.0,
+                        help="Replay at N times the captured pace; 0 sends back to back (default: 1)")
+    return parser.parse_args()
+
+
+def main() -> None:
+    args = parse_args()
+    try:
+        records = load_trace(args.trace)
+    except (OSError, RuntimeError) as exc:
+        print(f"error: {exc}", file=sys.stderr)
+        sys.exit(1)
+    if not records:
+        print(f"error: no replayable requests in {args.trace}", file=sys.stderr)
+        sys.exit(1)
+    builds = {"baseline": args.baseline}
+    if args.candidate:
+        builds["candidate"] = args.candidate
+    results: Dict[str, Tuple[Dict[str, float], Counter]] = {}
+    for name, path in builds.items():
+        module = load_build(path, f"zfs_helper_{name}", args.zfs_bin, args.policy_root, args.policy_artifact)
+        latencies, statuses, elapsed = replay(module, records, args.speed)
+        results[name] = (summarize(latencies, elapsed), statuses)
+    print(f"replayed {len(records)} requests from {args.trace} at speed {args.speed:g}")
+    print_report(results)
+
+
+if __name__ == "__main__":
+    main()